@@ -1,17 +1,31 @@
-import discord
-from discord.ext import commands
+import time
+_boot_started = time.perf_counter()
+
+import asyncio
+import importlib
 import os
+import signal
 from dotenv import load_dotenv
-from players import Players
-from typing import Any
 
 load_dotenv()
 
+import discord
+from discord.ext import commands
+from players import Players
+from rate_limit import RateLimited, rate_limited, should_notify, load_monitor
+from redis_queue import get_top_songs, get_top_listeners
+from typing import Any
+
 intents = discord.Intents.default()
 intents.message_content = True
 prefix = "#"
 
 env = os.getenv("PY_ENV", "development")
+profile_startup = os.getenv("PROFILE_STARTUP", "0") == "1"
+
+def log_startup(step: str):
+    if profile_startup:
+        print(f"=== [startup] {step} at {time.perf_counter() - _boot_started:.3f}s ===")
 
 if env == "production":
     print("=== Loading opus in prod ===")
@@ -20,14 +34,63 @@ if env == "production":
 
     if not discord.opus.is_loaded():
         raise Exception("Opus is not loaded")
+    log_startup("opus loaded")
+
+class KlaraBot(commands.AutoShardedBot):
+    async def setup_hook(self):
+        # Deploys stop the container with SIGTERM, close cleanly so sessions are saved
+        try:
+            self.loop.add_signal_handler(signal.SIGTERM, lambda: self.loop.create_task(self.close()))
+        except NotImplementedError:
+            # Windows event loops don't support signal handlers
+            signal.signal(signal.SIGTERM, lambda *_: self.loop.call_soon_threadsafe(self.loop.create_task, self.close()))
 
-bot = commands.AutoShardedBot(command_prefix=prefix, intents=intents)
+    async def close(self):
+        players.shutdown()
+        await super().close()
+
+bot = KlaraBot(command_prefix=prefix, intents=intents)
 
 players = Players(bot)
 
+log_startup("imports done")
+
 @bot.event
 async def on_ready():
     print(f'Logged in as {bot.user.name}')
+    log_startup("on_ready")
+    bot.loop.create_task(warm_restart())
+
+async def warm_restart():
+    loop = asyncio.get_event_loop()
+    load_monitor.start(loop)
+    # yt_dlp's extractors load after gateway connect so they don't delay login
+    preload = loop.run_in_executor(None, importlib.import_module, "yt_dlp")
+
+    try:
+        await players.restore_sessions()
+        log_startup("sessions restored")
+    except Exception as err:
+        print("Failed to restore sessions")
+        print(err)
+    players.start_snapshots()
+
+    await preload
+    log_startup("yt_dlp loaded")
+
+@bot.event
+async def on_command_error(ctx, error):
+    if isinstance(error, commands.CommandNotFound):
+        return
+    if isinstance(error, RateLimited):
+        if not should_notify(error):
+            return
+        return await ctx.send(f"Slow down! Try `{error.command}` again in {max(error.retry_after, 1):.0f}s.")
+    if isinstance(error, commands.BadArgument):
+        return await ctx.send(str(error))
+
+    print(f"Error in command {ctx.command}")
+    print(error)
 
 # @bot.event
 # async def on_voice_state_update(member, before, after):
@@ -41,6 +104,7 @@ async def on_ready():
 #         print("=== Something happened ===")
 #         print(err)
 
+@rate_limited("join")
 @bot.command()
 async def join(ctx):
     """Make Clara joining channel. Usage: `!join`"""
@@ -73,6 +137,12 @@ async def leave(ctx):
         print("Something happened")
         print(err)
 
+def play_cost(ctx):
+    """Every `;;` query is its own extraction, so each one takes a token."""
+    query = ctx.kwargs.get("query")
+    return len(query.split(";;")) if query else 1
+
+@rate_limited("play", cost=play_cost)
 @bot.command()
 async def play(ctx, *, query=None):
     """Clara will playing song. 
@@ -141,6 +211,7 @@ def parse_queue(song_queue: list[Any]):
 
     return message    
     
+@rate_limited("queue")
 @bot.command()
 async def queue(ctx):
     """List of currently queued song, song will be saved unless cleared. Usage: `!queue`"""
@@ -190,8 +261,7 @@ async def pause(ctx):
     """Clara will pause currently playing song. Usage: `!pause`"""
     try:
         player = players.get_player(ctx)
-        if player.voice_client and player.voice_client.is_playing():
-            player.voice_client.pause()
+        if player.pause():
             await ctx.send("Paused the song.")
         else:
             await ctx.send("I'm not playing anything.")
@@ -204,8 +274,7 @@ async def resume(ctx):
     """Clara will resume currently paused song. Usage: `!resume`"""
     try:
         player = players.get_player(ctx)
-        if player.voice_client and player.voice_client.is_paused():
-            player.voice_client.resume()
+        if player.resume():
             await ctx.send("Resumed the song.")
         else:
             await ctx.send("The song is not paused.")
@@ -240,6 +309,36 @@ async def repeat(ctx):
         print("Something happened")
         print(err)
 
+def parse_stats(top_songs: list[Any], top_listeners: list[Any]):
+    message = "**Top Songs This Week:**\n"
+
+    if top_songs:
+        for i, song in enumerate(top_songs):
+            message += f"{i+1}. {song.get('name') or 'Unknown Title'} ({song.get('count')} plays)\n"
+    else:
+        message += "No songs played yet.\n"
+
+    message += "\n**Top Listeners This Week:**\n"
+
+    if top_listeners:
+        for i, listener in enumerate(top_listeners):
+            message += f"{i+1}. {listener.get('name') or 'Unknown User'} ({listener.get('count')} songs listened)\n"
+    else:
+        message += "No listeners yet.\n"
+
+    return message[:1990]
+
+@bot.command(aliases=["top"])
+async def stats(ctx):
+    """Clara will show this week's top songs and listeners in this server. Usage: `!stats` or `!top`"""
+    try:
+        top_songs = get_top_songs(ctx.guild.id, limit=10)
+        top_listeners = get_top_listeners(ctx.guild.id, limit=10)
+        await ctx.send(parse_stats(top_songs, top_listeners))
+    except Exception as err:
+        print("Something happened")
+        print(err)
+
 TOKEN = os.getenv('DISCORD_TOKEN')
 if TOKEN is None:
     print("DISCORD_TOKEN not found in .env file. Please create a .env file and add your bot token.")
@@ -1,9 +1,10 @@
 import asyncio
+import time
 import discord
 from discord.ext.commands import AutoShardedBot
-import yt_dlp
 from urllib.parse import parse_qs, urlparse
-from redis_queue import add_to_queue, get_from_queue, get_queue, clear_queue, remove_from_queue, set_repeat, get_repeat, remove_first_queue, publish_song_added, publish_song_listened, set_song_url, get_song_url
+from rate_limit import Overloaded, load_monitor
+from redis_queue import add_to_queue, get_from_queue, get_queue, clear_queue, remove_from_queue, set_repeat, get_repeat, remove_first_queue, publish_song_added, publish_song_listened, set_song_url, get_song_url, remove_session
 
 YDL_OPTIONS = {'format': 'bestaudio', 'noplaylist': 'True'}
 FFMPEG_OPTIONS = {
@@ -22,6 +23,12 @@ class GuildPlayer:
         self.current_song = None
         self.repeat = get_repeat(guild.id) or False
         self.max_retries = 2
+        self.text_channel = None
+        self.song_url = None
+        self._start_offset = 0
+        self._started_at = None
+        self._paused_at = None
+        self._closing = False
 
         if guild.voice_client:
             self.voice_client = guild.voice_client
@@ -43,6 +50,7 @@ class GuildPlayer:
             await self.voice_client.disconnect()
             self.voice_client = None
             self.joined = False
+        remove_session(self.guild.id)
     
     def get_song_info(self, song_query: str):
         if song_query.startswith('http'):
@@ -52,6 +60,9 @@ class GuildPlayer:
 
         url = f"ytsearch:{song_query}"
 
+        # Imported lazily, yt_dlp's extractors are a large share of startup time
+        import yt_dlp
+
         with yt_dlp.YoutubeDL(YDL_OPTIONS) as ydl:
             info = ydl.extract_info(
                 url, 
@@ -72,7 +83,8 @@ class GuildPlayer:
         song_query = query.strip()
 
         try:
-            info = await loop.run_in_executor(None, self.get_song_info, song_query)
+            async with load_monitor.extraction():
+                info = await loop.run_in_executor(None, self.get_song_info, song_query)
 
             if not info:
                 raise RuntimeError("Failed to get song info")
@@ -83,6 +95,8 @@ class GuildPlayer:
             title = info.get('title', 'Unknown Title').strip()
             duration = info.get('duration', 0)  # duration in seconds
             print(f"{webpage_url=}; {url=}; {duration=}")
+        except Overloaded:
+            return await ctx.send(f"Clara is busy right now, please try `{song_query}` again in a moment.")
         except Exception as e:
             await ctx.send("There was an error searching for the song.")
             print(f"Error fetching song info: {e}")
@@ -114,11 +128,15 @@ class GuildPlayer:
             await ctx.send(f"{song_data['title']} is added to queue.")
 
 
-    async def play_next(self, ctx, retries = 0):
-        """Plays the next song in the queue."""
+    async def play_next(self, ctx, retries = 0, start_at = 0):
+        """Plays the next song in the queue, optionally seeking `start_at` seconds in."""
         song_data = get_from_queue(self.guild.id)
+        self.text_channel = getattr(ctx, "channel", ctx)
 
         if not song_data:
+            self.is_playing = False
+            self.current_song = None
+            remove_session(self.guild.id)
             return await ctx.send("No song in queue.")
 
         song_title = song_data.get("title")
@@ -126,7 +144,9 @@ class GuildPlayer:
         song_url = get_song_url(webpage_url)
 
         if not song_url:
-            song_data = self.get_song_info(webpage_url)
+            # Already queued, wait for a slot instead of dropping it
+            async with load_monitor.extraction(shed=False):
+                song_data = await asyncio.get_event_loop().run_in_executor(None, self.get_song_info, webpage_url)
             webpage_url = song_data["webpage_url"]
             song_url = song_data['url']
             song_title = song_data.get('title')
@@ -141,11 +161,18 @@ class GuildPlayer:
             return await ctx.send("Failed to retrieve song url.")
 
         self.current_song = song_data
+        self.song_url = song_url.decode("utf-8") if isinstance(song_url, bytes) else song_url
 
         def after_play(e):
+            # Voice is torn down on shutdown, keep the queue and session for the warm restart
+            if self._closing:
+                self.is_playing = False
+                return
+
+            channel = self.voice_client.channel if self.voice_client else None
             listened_members = [
                 {"id": member.id, "name": member.name}
-                for member in ctx.voice_client.channel.members if not member.bot
+                for member in (channel.members if channel else []) if not member.bot
             ]
             
             event_data = {
@@ -172,17 +199,24 @@ class GuildPlayer:
             msg = f"Playing {song_title or "unnamed song"}."
             await ctx.send(msg)
     
+            ffmpeg_options = dict(FFMPEG_OPTIONS)
+            if start_at:
+                ffmpeg_options['before_options'] = f"-ss {start_at:.2f} {ffmpeg_options['before_options']}"
+
             try:
                 self.is_playing = True
                 self.voice_client.play(
-                    discord.FFmpegPCMAudio(song_url, **FFMPEG_OPTIONS),
+                    discord.FFmpegPCMAudio(song_url, **ffmpeg_options),
                     after=after_play,
                 )
+                self._start_offset = start_at
+                self._started_at = time.monotonic()
+                self._paused_at = None
             except Exception as err:
                 print(err)
                 self.is_playing = False
                 if retries < self.max_retries:
-                    return await self.play_next(ctx, retries + 1)
+                    return await self.play_next(ctx, retries + 1, start_at)
                 else:
                     return await ctx.send("Failed to play song")
         else:
@@ -191,6 +225,90 @@ class GuildPlayer:
             self.is_playing = False
             self.current_song = None
 
+    def pause(self):
+        """Pauses the current song. Returns False if nothing is playing."""
+        if not self.voice_client or not self.voice_client.is_playing():
+            return False
+
+        self.voice_client.pause()
+        self._paused_at = time.monotonic()
+        return True
+
+    def resume(self):
+        """Resumes the paused song. Returns False if the song is not paused."""
+        if not self.voice_client or not self.voice_client.is_paused():
+            return False
+
+        self.voice_client.resume()
+        if self._started_at is not None and self._paused_at is not None:
+            self._started_at += time.monotonic() - self._paused_at
+        self._paused_at = None
+        return True
+
+    def elapsed(self):
+        """Seconds played of the current song, excluding time spent paused."""
+        if self._started_at is None:
+            return 0
+
+        now = self._paused_at or time.monotonic()
+        return self._start_offset + max(now - self._started_at, 0)
+
+    def snapshot(self):
+        """Compact snapshot of the active session, or None when nothing is playing."""
+        if not self.voice_client or not self.voice_client.is_connected():
+            return None
+        if not self.is_playing or not self.current_song:
+            return None
+
+        return {
+            "guild_id": self.guild.id,
+            "channel_id": self.voice_client.channel.id,
+            "text_channel_id": self.text_channel.id if self.text_channel else None,
+            "webpage_url": self.current_song.get("webpage_url"),
+            "song_url": self.song_url,
+            "elapsed": round(self.elapsed(), 2),
+            "paused": self._paused_at is not None,
+        }
+
+    def prepare_shutdown(self):
+        """Stops the song ending callback from advancing the queue while closing."""
+        self._closing = True
+
+    async def restore_session(self, session: dict):
+        """Reconnects and resumes playback from a session snapshot."""
+        channel = self.guild.get_channel(session.get("channel_id"))
+        text_channel = self.bot.get_channel(session.get("text_channel_id") or 0)
+        if not channel or not text_channel:
+            remove_session(self.guild.id)
+            return False
+
+        # Everyone left during the restart, don't play to an empty room
+        if not any(not member.bot for member in channel.members):
+            remove_session(self.guild.id)
+            return False
+
+        # The queue head is the song that was playing, only seek when it still matches
+        song_data = get_from_queue(self.guild.id)
+        if not song_data:
+            remove_session(self.guild.id)
+            return False
+
+        webpage_url = session.get("webpage_url")
+        start_at = 0
+        if song_data.get("webpage_url") == webpage_url:
+            start_at = session.get("elapsed") or 0
+            song_url = session.get("song_url")
+            expired_at = self._get_song_expiration(song_url)
+            if not get_song_url(webpage_url) and expired_at and expired_at > time.time():
+                set_song_url(webpage_url, song_url, expired_at)
+
+        await self.join(channel)
+        await self.play_next(text_channel, start_at=start_at)
+
+        if session.get("paused"):
+            self.pause()
+        return True
+
     def toggle_repeat(self):
         """Toggles the repeat mode."""
         self.repeat = not self.repeat
@@ -211,6 +329,7 @@ class GuildPlayer:
         if self.voice_client:
             self.voice_client.stop()
         clear_queue(self.guild.id)
+        remove_session(self.guild.id)
         self.is_playing = False
         self.current_song = None
         self.joined = False
@@ -1,12 +1,26 @@
+import asyncio
+import os
 from guild_player import GuildPlayer
+from redis_queue import get_sessions, save_sessions
+
+SESSION_SNAPSHOT_INTERVAL = int(os.environ.get("SESSION_SNAPSHOT_INTERVAL", 15))
+SESSION_TTL = int(os.environ.get("SESSION_TTL", 600))
+SESSION_RESTORE_CONCURRENCY = int(os.environ.get("SESSION_RESTORE_CONCURRENCY", 5))
+SESSION_RESTORE_DELAY = float(os.environ.get("SESSION_RESTORE_DELAY", 1))
 
 class Players:
     def __init__(self, bot):
         self.bot = bot
         self._players = {}
+        self._snapshot_task = None
+        self._restored = False
+        self._closing = False
+        self._saved_sessions = set()
 
     def get_player(self, ctx) -> GuildPlayer:
-        guild = ctx.guild
+        return self.get_guild_player(ctx.guild)
+
+    def get_guild_player(self, guild) -> GuildPlayer:
         if guild.id not in self._players:
             self._players[guild.id] = GuildPlayer(guild, self.bot)
 
@@ -19,4 +33,87 @@ class Players:
         guild = ctx.guild
 
         if guild.id in self._players:
-            self._players.pop(guild.id)
\ No newline at end of file
+            self._players.pop(guild.id)
+
+    def save_sessions(self):
+        """Snapshots every active guild session to redis.
+        Idle players are skipped, only sessions saved on the last pass get removed."""
+        sessions = {}
+        for guild_id, player in list(self._players.items()):
+            if not player.is_playing:
+                continue
+
+            try:
+                session = player.snapshot()
+            except Exception as err:
+                print(f"Failed to snapshot session for guild {guild_id}")
+                print(err)
+                continue
+
+            if session:
+                sessions[guild_id] = session
+
+        removed = list(self._saved_sessions - sessions.keys())
+        try:
+            save_sessions(sessions, removed, SESSION_TTL)
+            self._saved_sessions = set(sessions)
+        except Exception as err:
+            print("Failed to save sessions")
+            print(err)
+
+    def start_snapshots(self):
+        """Starts the periodic session snapshot task, once per process."""
+        if self._snapshot_task and not self._snapshot_task.done():
+            return
+
+        self._snapshot_task = self.bot.loop.create_task(self._snapshot_loop())
+
+    async def _snapshot_loop(self):
+        while not self.bot.is_closed():
+            self.save_sessions()
+            await asyncio.sleep(SESSION_SNAPSHOT_INTERVAL)
+
+    def shutdown(self):
+        """Saves a final snapshot of every session before voice is disconnected."""
+        # close() can run more than once, later snapshots would see voice gone and drop sessions
+        if self._closing:
+            return
+        self._closing = True
+
+        if self._snapshot_task:
+            self._snapshot_task.cancel()
+
+        self.save_sessions()
+        for player in self._players.values():
+            player.prepare_shutdown()
+
+    async def restore_sessions(self):
+        """Restores sessions saved by a previous process, once per process."""
+        if self._restored:
+            return
+        self._restored = True
+
+        sessions = get_sessions()
+        if not sessions:
+            return
+
+        print(f"=== Restoring {len(sessions)} sessions ===")
+        semaphore = asyncio.Semaphore(SESSION_RESTORE_CONCURRENCY)
+
+        async def restore(session):
+            guild = self.bot.get_guild(session.get("guild_id") or 0)
+            # Guilds on shards of another process, left for the ttl to expire
+            if not guild:
+                return
+
+            async with semaphore:
+                try:
+                    await self.get_guild_player(guild).restore_session(session)
+                except Exception as err:
+                    print(f"Failed to restore session for guild {guild.id}")
+                    print(err)
+                    remove_session(guild.id)
+                # Spread voice reconnects out to stay under the gateway rate limit
+                await asyncio.sleep(SESSION_RESTORE_DELAY)
+
+        await asyncio.gather(*(restore(session) for session in sessions))
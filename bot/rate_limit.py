@@ -0,0 +1,139 @@
+import asyncio
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from discord.ext import commands
+from redis_queue import claim_flag, take_tokens
+
+# (tokens per second, bucket capacity) per command, for each user and for the whole guild
+COMMAND_LIMITS = {
+    "play": {"user": (1 / 3, 5), "guild": (1, 10)},
+    "queue": {"user": (1 / 2, 3), "guild": (1, 5)},
+    "join": {"user": (1 / 5, 2), "guild": (1 / 5, 3)},
+}
+
+EXTRACTION_DEFER_BACKLOG = int(os.environ.get("EXTRACTION_DEFER_BACKLOG", 4))
+EXTRACTION_SHED_BACKLOG = int(os.environ.get("EXTRACTION_SHED_BACKLOG", 16))
+LOOP_LAG_DEFER = float(os.environ.get("LOOP_LAG_DEFER", 0.1))
+LOOP_LAG_SHED = float(os.environ.get("LOOP_LAG_SHED", 0.5))
+EXTRACTION_DEFER_TIMEOUT = float(os.environ.get("EXTRACTION_DEFER_TIMEOUT", 10))
+
+class RateLimited(commands.CommandError):
+    def __init__(self, command: str, retry_after: float, bucket: str):
+        self.command = command
+        self.retry_after = retry_after
+        self.bucket = bucket
+        super().__init__(f"{command} is rate limited, retry after {retry_after:.1f}s")
+
+def should_notify(error: RateLimited):
+    """True only for the first throttled call of a bucket window, so spam doesn't cost a reply each."""
+    try:
+        return claim_flag(f"{error.bucket}:notified", max(math.ceil(error.retry_after), 1))
+    except Exception as err:
+        print("Failed to check rate limit notice")
+        print(err)
+        return False
+
+class Overloaded(Exception):
+    pass
+
+def rate_limited(command: str, cost=None):
+    """Takes tokens from the guild and user buckets of `command` before it runs.
+
+    Registered as a before_invoke hook rather than a check, so `!help` doesn't
+    spend tokens. `cost(ctx)` gives the number of tokens a call takes, default 1.
+    Apply it above `@bot.command()`."""
+    limits = COMMAND_LIMITS[command]
+    guild_rate, guild_capacity = limits["guild"]
+    user_rate, user_capacity = limits["user"]
+    max_cost = min(guild_capacity, user_capacity)
+
+    async def hook(ctx):
+        count = cost(ctx) if cost else 1
+        if count > max_cost:
+            raise commands.BadArgument(f"At most {max_cost} at once for `{command}`.")
+
+        user_bucket = f"{command}:user:{ctx.guild.id}:{ctx.author.id}"
+        buckets = [
+            (f"{command}:guild:{ctx.guild.id}", guild_rate, guild_capacity),
+            (user_bucket, user_rate, user_capacity),
+        ]
+
+        try:
+            retry_after = take_tokens(buckets, count)
+        except Exception as err:
+            # Don't lock everyone out when redis is unavailable
+            print("Failed to check rate limit")
+            print(err)
+            return
+
+        if retry_after:
+            raise RateLimited(command, retry_after, user_bucket)
+
+    def decorator(cmd: commands.Command):
+        cmd.before_invoke(hook)
+        return cmd
+
+    return decorator
+
+class LoadMonitor:
+    """Gates extraction work on executor backlog and event loop lag.
+
+    At most EXTRACTION_DEFER_BACKLOG extractions run at once, the rest wait their
+    turn. New work is refused once EXTRACTION_SHED_BACKLOG are running or waiting,
+    or the loop lags past LOOP_LAG_SHED."""
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self.backlog = 0
+        self.loop_lag = 0
+        self._semaphore = asyncio.Semaphore(EXTRACTION_DEFER_BACKLOG)
+        self._task = None
+
+    def start(self, loop):
+        if self._task and not self._task.done():
+            return
+
+        self._task = loop.create_task(self._measure_lag())
+
+    async def _measure_lag(self):
+        while True:
+            started_at = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.loop_lag = max(time.monotonic() - started_at - self.interval, 0)
+
+    def should_shed(self):
+        return self.backlog >= EXTRACTION_SHED_BACKLOG or self.loop_lag >= LOOP_LAG_SHED
+
+    @asynccontextmanager
+    async def extraction(self, shed: bool = True):
+        """Holds an extraction slot while the block runs.
+
+        With `shed`, raises Overloaded instead of queueing when overloaded or when
+        no slot frees up within EXTRACTION_DEFER_TIMEOUT. Without it the caller
+        always waits, for work that was already accepted."""
+        if shed and self.should_shed():
+            raise Overloaded()
+
+        self.backlog += 1
+        try:
+            deadline = time.monotonic() + EXTRACTION_DEFER_TIMEOUT
+            try:
+                if shed:
+                    await asyncio.wait_for(self._semaphore.acquire(), EXTRACTION_DEFER_TIMEOUT)
+                else:
+                    await self._semaphore.acquire()
+            except asyncio.TimeoutError:
+                raise Overloaded()
+
+            try:
+                # Slot holders back off while the loop is lagging
+                while self.loop_lag >= LOOP_LAG_DEFER and time.monotonic() < deadline:
+                    await asyncio.sleep(self.interval)
+                yield
+            finally:
+                self._semaphore.release()
+        finally:
+            self.backlog -= 1
+
+load_monitor = LoadMonitor()
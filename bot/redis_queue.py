@@ -1,42 +1,94 @@
-import redis
 import os
 import json
-
-REDIS_HOST = os.environ.get("REDIS_HOST", "127.0.0.1")
-REDIS_PORT = int(os.environ.get("REDIS_PORT", 6379))
-
-r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0) # decode_responses=False because we're handling JSON
+from datetime import datetime, timezone
+
+_redis = None
+_take_tokens_script = None
+
+# Token bucket over several keys, consumes from all of them or none.
+# ARGV[1] is the token count, followed by a (rate per second, capacity) pair per key.
+TAKE_TOKENS_LUA = """
+local count = tonumber(ARGV[1])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local buckets = {}
+local retry_after = 0
+
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local capacity = tonumber(ARGV[i * 2 + 1])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(now - ts, 0) * rate)
+    if tokens < count then
+        retry_after = math.max(retry_after, (count - tokens) / rate)
+    end
+    buckets[i] = tokens
+end
+
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local capacity = tonumber(ARGV[i * 2 + 1])
+    local tokens = buckets[i]
+    if retry_after == 0 then
+        tokens = tokens - count
+    end
+    redis.call('HSET', key, 'tokens', tostring(tokens), 'ts', tostring(now))
+    redis.call('EXPIRE', key, math.ceil(capacity / rate) + 1)
+end
+
+return tostring(retry_after)
+"""
+
+def get_redis():
+    """Gets the redis client, connecting and health-checking it on first use."""
+    global _redis
+    if _redis is not None:
+        return _redis
+
+    import redis
+
+    client = redis.Redis(
+        host=os.environ.get("REDIS_HOST", "127.0.0.1"),
+        port=int(os.environ.get("REDIS_PORT", 6379)),
+        db=0,
+        health_check_interval=30,
+    ) # decode_responses=False because we're handling JSON
+    client.ping()
+    _redis = client
+    return _redis
 
 def add_to_queue(guild_id: int, song_data: dict):
     """Adds a song to the end of a guild's queue."""
     if not guild_id or not song_data:
         return 
     
-    r.rpush(f"queue:{guild_id}", json.dumps(song_data))
+    get_redis().rpush(f"queue:{guild_id}", json.dumps(song_data))
 
 def add_to_front_of_queue(guild_id: int, song_data: dict):
     """Adds a song to the front of a guild's queue."""
     if not guild_id or not song_data:
         return
     
-    r.lpush(f"queue:{guild_id}", json.dumps(song_data))
+    get_redis().lpush(f"queue:{guild_id}", json.dumps(song_data))
 
 def get_from_queue(guild_id: int):
     """Retrieves and removes the next song from a guild's queue."""
-    song_json = r.lindex(f"queue:{guild_id}", 0)
+    song_json = get_redis().lindex(f"queue:{guild_id}", 0)
     if song_json:
         return json.loads(song_json)
     return None
 
 def remove_first_queue(guild_id: int):
-    song_json = r.lpop(f"queue:{guild_id}")
+    song_json = get_redis().lpop(f"queue:{guild_id}")
     if not song_json: 
         return None
     return json.loads(song_json)
 
 def get_queue(guild_id: int):
     """Gets the entire queue for a guild without modifying it."""
-    queue_json_list = r.lrange(f"queue:{guild_id}", 0, -1)
+    queue_json_list = get_redis().lrange(f"queue:{guild_id}", 0, -1)
     return [json.loads(song_json) for song_json in queue_json_list if song_json]
 
 def get_song_url(webpage_url: str):
@@ -44,41 +96,109 @@ def get_song_url(webpage_url: str):
     if not webpage_url:
         return
     
-    return r.get(webpage_url)
+    return get_redis().get(webpage_url)
 
 def set_song_url(webpage_url: str, url: str, expired_at: int):
     """Set youtube song url with expiration date"""
     if not webpage_url or not url or not expired_at:
         return
     
-    r.set(webpage_url, url, exat=expired_at)
+    get_redis().set(webpage_url, url, exat=expired_at)
 
 def remove_from_queue(guild_id: int, index: int):
     """Removes a song from the queue at a specific index."""
-    queue_len = r.llen(f"queue:{guild_id}")
+    queue_len = get_redis().llen(f"queue:{guild_id}")
     if not (-queue_len <= index < queue_len):
         return False # Index out of bounds
 
-    item_to_remove_json = r.lindex(f"queue:{guild_id}", index)
+    item_to_remove_json = get_redis().lindex(f"queue:{guild_id}", index)
     if item_to_remove_json:
-        r.lrem(f"queue:{guild_id}", 0, item_to_remove_json)
+        get_redis().lrem(f"queue:{guild_id}", 0, item_to_remove_json)
         return True
     return False
 
 def clear_queue(guild_id: int):
     """Clears the entire queue for a guild."""
-    r.delete(f"queue:{guild_id}")
+    get_redis().delete(f"queue:{guild_id}")
 
 def set_repeat(guild_id: int, repeat: bool):
-    r.set(f"repeat:{guild_id}", int(repeat))
+    get_redis().set(f"repeat:{guild_id}", int(repeat))
 
 def get_repeat(guild_id: int):
-    return bool(r.get(f"repeat:{guild_id}"))
+    return bool(get_redis().get(f"repeat:{guild_id}"))
+
+def save_sessions(sessions: dict[int, dict], removed: list[int], ttl: int):
+    """Saves player session snapshots and removes ended ones in a single round trip."""
+    if not sessions and not removed:
+        return
+
+    pipe = get_redis().pipeline(transaction=False)
+    for guild_id, session_data in sessions.items():
+        pipe.set(f"session:{guild_id}", json.dumps(session_data), ex=ttl)
+    for guild_id in removed:
+        pipe.delete(f"session:{guild_id}")
+    pipe.execute()
+
+def get_sessions():
+    """Gets all saved player session snapshots."""
+    keys = list(get_redis().scan_iter(match="session:*"))
+    if not keys:
+        return []
+
+    return [json.loads(session_json) for session_json in get_redis().mget(keys) if session_json]
+
+def remove_session(guild_id: int):
+    """Removes a guild's player session snapshot."""
+    get_redis().delete(f"session:{guild_id}")
+
+def take_tokens(buckets: list[tuple[str, float, int]], count: int = 1):
+    """Takes `count` tokens from every (key, rate, capacity) bucket.
+    Returns 0 when allowed, otherwise seconds until enough tokens are available."""
+    global _take_tokens_script
+    if not buckets:
+        return 0
+
+    if _take_tokens_script is None:
+        _take_tokens_script = get_redis().register_script(TAKE_TOKENS_LUA)
+
+    keys = [f"ratelimit:{key}" for key, _, _ in buckets]
+    args = [count] + [value for _, rate, capacity in buckets for value in (rate, capacity)]
+    return float(_take_tokens_script(keys=keys, args=args))
+
+def claim_flag(key: str, ttl: int):
+    """Sets a short-lived flag, returns False if it was already set."""
+    return bool(get_redis().set(f"ratelimit:{key}", 1, nx=True, ex=ttl))
 
 def publish_song_added(data: dict):
     """Publishes a song added event to a Redis pub/sub channel."""
-    r.publish("song_added", json.dumps(data))
+    get_redis().publish("song_added", json.dumps({**data, "bucket": current_stats_bucket()}))
 
 def publish_song_listened(data: dict):
     """Publishes a song listened event to a Redis pub/sub channel."""
-    r.publish("song_listened", json.dumps(data))
\ No newline at end of file
+    get_redis().publish("song_listened", json.dumps({**data, "bucket": current_stats_bucket()}))
+
+def current_stats_bucket():
+    """Weekly bucket stamped on published events, the log service keys stats by it."""
+    year, week, _ = datetime.now(timezone.utc).isocalendar()
+    return f"{year}-W{week}"
+
+def _get_top(guild_id: int, bucket: str, kind: str, names_kind: str, limit: int):
+    entries = get_redis().zrevrange(f"stats:{guild_id}:{bucket}:{kind}", 0, limit - 1, withscores=True)
+    if not entries:
+        return []
+
+    members = [member for member, _ in entries]
+    names = get_redis().hmget(f"stats:{guild_id}:{bucket}:{names_kind}", members)
+
+    return [
+        {"id": member.decode("utf-8"), "name": name.decode("utf-8") if name else None, "count": int(score)}
+        for (member, score), name in zip(entries, names)
+    ]
+
+def get_top_songs(guild_id: int, bucket: str = None, limit: int = 10):
+    """Gets the most played songs of a guild for a weekly bucket."""
+    return _get_top(guild_id, bucket or current_stats_bucket(), "songs", "titles", limit)
+
+def get_top_listeners(guild_id: int, bucket: str = None, limit: int = 10):
+    """Gets the most active listeners of a guild for a weekly bucket."""
+    return _get_top(guild_id, bucket or current_stats_bucket(), "listeners", "names", limit)
@@ -22,7 +22,7 @@ class Neo4j:
     @staticmethod
     def _create_song_graph(tx, data):
         query = """
-        WITH datetime().year + "-W" + datetime().week AS current_week
+        WITH coalesce($bucket, datetime().year + "-W" + datetime().week) AS current_week
 
         MERGE (u:User {id: $user_id})
         ON CREATE SET u.name = $user_name
@@ -47,13 +47,14 @@ class Neo4j:
             MERGE (s)-[:HAS_TAG]->(t)
         )
         """
-        tx.run(query, **data)
+        # Events carry the weekly bucket, older ones fall back to computing it here
+        tx.run(query, **{"bucket": None, **data})
         print(f"INFO: process_song_data with data: {data}")
 
     @staticmethod
     def _create_song_listened_graph(tx, data):
         query = """
-        WITH datetime().year + "-W" + datetime().week AS current_week
+        WITH coalesce($bucket, datetime().year + "-W" + datetime().week) AS current_week
 
         MERGE (s:Song {url: $song_url})
         ON CREATE SET s.title = $song_title, s.added_at = timestamp(), s.url = $song_url
@@ -75,6 +76,7 @@ class Neo4j:
             MERGE (u)-[:IN_GUILD]->(g)
         )
         """
-        tx.run(query, **data)
+        # Events carry the weekly bucket, older ones fall back to computing it here
+        tx.run(query, **{"bucket": None, **data})
         print(f"INFO: process_song_listened_data with data: {data}")
 
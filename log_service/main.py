@@ -4,6 +4,7 @@ import json
 import time
 from dotenv import load_dotenv
 from db import Neo4j
+from stats import WeeklyStats
 
 load_dotenv()
 
@@ -55,6 +56,8 @@ def main():
         exit(1)
 
 
+    stats = WeeklyStats(redis_conn)
+
     pubsub = redis_conn.pubsub()
     pubsub.subscribe("song_added")
     pubsub.subscribe("song_listened")
@@ -72,6 +75,12 @@ def main():
                     neo4j_conn.process_song_listened_data(data)
             except Exception as err:
                 print(f"{str(err)=}")
+
+            try:
+                if channel == 'song_listened':
+                    stats.process_song_listened_data(data)
+            except Exception as err:
+                print(f"{str(err)=}")
                 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,40 @@
+# Keep a few weeks around so "last week" style lookups still work
+STATS_TTL = 60 * 60 * 24 * 7 * 5
+
+def stats_key(guild_id, bucket: str, kind: str):
+    return f"stats:{guild_id}:{bucket}:{kind}"
+
+class WeeklyStats:
+    """Materialized per-guild, per-week leaderboards stored in Redis sorted sets.
+
+    Updated incrementally from song_listened events, so the bot can read
+    leaderboards without querying Neo4j. The weekly bucket comes from the
+    event itself, the bot stamps it when publishing.
+    """
+    def __init__(self, redis_conn):
+        self._redis = redis_conn
+
+    def process_song_listened_data(self, data):
+        guild_id = data["guild_id"]
+        bucket = data.get("bucket")
+        members = data.get("listened_members") or []
+        if not bucket or not members:
+            return
+
+        songs_key = stats_key(guild_id, bucket, "songs")
+        titles_key = stats_key(guild_id, bucket, "titles")
+        listeners_key = stats_key(guild_id, bucket, "listeners")
+        names_key = stats_key(guild_id, bucket, "names")
+
+        pipe = self._redis.pipeline()
+        pipe.zincrby(songs_key, 1, data["song_url"])
+        pipe.hset(titles_key, data["song_url"], data["song_title"])
+
+        for member in members:
+            pipe.zincrby(listeners_key, 1, member["id"])
+            pipe.hset(names_key, member["id"], member["name"])
+
+        for key in (songs_key, titles_key, listeners_key, names_key):
+            pipe.expire(key, STATS_TTL)
+        pipe.execute()
+        print(f"INFO: stats process_song_listened_data for guild {guild_id} in {bucket}")